@@ -0,0 +1,4 @@
+# Makes the src package importable from the tests
+
+# Script for manual checks against a local video, not a test
+collect_ignore = ["test_data_loader.py"]
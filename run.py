@@ -1,13 +1,29 @@
+import time
+start_time = time.perf_counter()
+
 import sys
 import yaml
 
-from PyQt6.QtWidgets import QApplication
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QTimer
 
 from src.main_window import MainWindow
 
 config = yaml.safe_load(open("config.yaml"))
 
+
+def report_startup_time():
+    elapsed = time.perf_counter() - start_time
+    budget = config.get("startup_budget", 1.0)
+    print(f"Startup took {elapsed:.3f}s (budget {budget:.3f}s)")
+    if elapsed > budget:
+        print(f"Warning: startup exceeded the budget by {elapsed - budget:.3f}s", file=sys.stderr)
+
+
 app = QApplication(sys.argv)
 window = MainWindow(config)
 window.show()
-sys.exit(app.exec())
\ No newline at end of file
+
+# Runs on the first iteration of the event loop, once the window is shown
+QTimer.singleShot(0, report_startup_time)
+sys.exit(app.exec())
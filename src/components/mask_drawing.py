@@ -1,13 +1,17 @@
 import os
 import numpy as np
 import cv2
-from PySide6.QtWidgets import QLabel, QMessageBox
+from PySide6.QtWidgets import QLabel, QMessageBox, QToolTip
 from PySide6.QtGui import QPixmap, QImage, QPainter, QColor
-from PySide6.QtCore import Qt, QPoint, QSize
+from PySide6.QtCore import Qt, QPoint, QSize, Signal
 
-from src.utils import ImageMasks
+from src.masks import ImageMasks
 
 class MaskPainter(QLabel):
+    # Emitted with the label and the changed (top, left, bottom, right) region,
+    # or None for the whole mask, once a change of the masks is committed
+    mask_changed = Signal(str, object)
+
     def __init__(self, labels):
         super().__init__()
 
@@ -31,6 +35,11 @@ class MaskPainter(QLabel):
 
         self.drawing = False
         self.last_point = None
+        self.stroke_roi = None
+
+        # Future of the superpixel map of the current image, used by the region brush
+        self.superpixels = None
+        self.stroke_regions = set()
 
         self.history = []
         self.redo_stack = []
@@ -76,6 +85,9 @@ class MaskPainter(QLabel):
     def set_masks(self, masks):
         self.masks = masks
 
+    def set_superpixels(self, superpixels):
+        self.superpixels = superpixels
+
     def reset_zoom(self):
         self._zoom = 0.75
 
@@ -99,6 +111,18 @@ class MaskPainter(QLabel):
 
 
 
+    def mask_alpha(self, label):
+        # Provisional (generated) masks are drawn fainter until confirmed
+        alpha = self.label_colors[label].alpha()
+        if self.masks.is_provisional(label):
+            alpha = alpha // 2
+        return alpha
+
+    def confirm_current_mask(self):
+        self.masks.confirm(self.active_label)
+        self.mask_changed.emit(self.active_label, None)
+        self.update_display()
+
     def update_display(self):
         h, w = self.image.shape[:2]
 
@@ -116,13 +140,13 @@ class MaskPainter(QLabel):
                 mask = self.current_mask()
                 if mask is not None:
                     color = self.label_colors[self.active_label]
-                    r, g, b, a = color.red(), color.green(), color.blue(), color.alpha()
+                    r, g, b, a = color.red(), color.green(), color.blue(), self.mask_alpha(self.active_label)
                     overlay[mask > 0] = [r, g, b, a]
             elif self.mask_view_mode == "All":
                 for label, color in self.label_colors.items():
                     mask = self.masks.get(label)
                     if mask is not None:
-                        r, g, b, a = color.red(), color.green(), color.blue(), color.alpha()
+                        r, g, b, a = color.red(), color.green(), color.blue(), self.mask_alpha(label)
                         overlay[mask > 0] = [r, g, b, a]
 
         overlay_img = QImage(overlay.data, w, h, overlay.strides[0], QImage.Format_RGBA8888)
@@ -137,11 +161,11 @@ class MaskPainter(QLabel):
         painter = QPainter(scaled_pixmap)
         if self.show_cursor_circle:
             # brush size is thickness (diameter), so radius = size/2
-            radius = int((self.pen_size if self.mode == 'draw' else self.eraser_size) * self._zoom / 2)
+            radius = int((self.eraser_size if self.mode == 'erase' else self.pen_size) * self._zoom / 2)
             if radius < 1:
                 radius = 1  # ensure visible minimum radius
 
-            color = self.cursor_color_draw if self.mode == 'draw' else self.cursor_color_erase
+            color = self.cursor_color_erase if self.mode == 'erase' else self.cursor_color_draw
 
             painter.setRenderHint(QPainter.Antialiasing)
             painter.setBrush(color)
@@ -154,6 +178,21 @@ class MaskPainter(QLabel):
         self.setFixedSize(scaled_pixmap.size())
 
 
+    def show_composited(self, image):
+        """Displays an RGB image with the masks already blended in, used for playback."""
+        h, w = image.shape[:2]
+        qimage = QImage(image.data, w, h, image.strides[0], QImage.Format_RGB888)
+        pixmap = QPixmap.fromImage(qimage).scaled(int(w * self._zoom), int(h * self._zoom), Qt.KeepAspectRatio)
+        self.setPixmap(pixmap)
+        self.setFixedSize(pixmap.size())
+
+    def overlay_colors(self):
+        """RGBA colors of the labels currently drawn on the canvas."""
+        if not self.show_masks:
+            return {}
+        labels = [self.active_label] if self.mask_view_mode == "Current" else list(self.label_colors)
+        return {label: self.label_colors[label].getRgb() for label in labels}
+
     def widget_to_image(self, pos):
         """Convert widget coordinates to image pixel coordinates."""
         x = int(pos.x() / self._zoom)
@@ -170,6 +209,7 @@ class MaskPainter(QLabel):
                 return
             self.drawing = True
             self.last_point = img_pt
+            self.stroke_roi = None
 
             # Save undo state
             self.history.append(self.current_mask().copy())
@@ -177,6 +217,41 @@ class MaskPainter(QLabel):
                 self.history.pop(0)
             self.redo_stack.clear()
 
+            if self.mode == 'region':
+                self.stroke_regions.clear()
+                self.fill_region(img_pt)
+                self.update_display()
+
+    def fill_region(self, img_pt):
+        """Fills the superpixel under an image point in the active mask."""
+        if self.superpixels is None:
+            return
+
+        # Never block the GUI on the background computation
+        if not self.superpixels.done():
+            QToolTip.showText(self.mapToGlobal(self.cursor_pos), "Region map is not ready yet", self)
+            return
+
+        superpixels = self.superpixels.result()
+        if superpixels.label_at(img_pt.x(), img_pt.y()) in self.stroke_regions:
+            return
+
+        current_mask = self.current_mask()
+        region = superpixels.fill(current_mask, img_pt.x(), img_pt.y())
+        self.masks.set(mask=current_mask, label=self.active_label)
+        self.stroke_regions.add(region)
+
+        ys, xs = np.divmod(superpixels.region(region), current_mask.shape[1])
+        self.extend_stroke_roi(ys.min(), xs.min(), ys.max() + 1, xs.max() + 1)
+
+    def extend_stroke_roi(self, top, left, bottom, right):
+        if self.stroke_roi is not None:
+            top = min(top, self.stroke_roi[0])
+            left = min(left, self.stroke_roi[1])
+            bottom = max(bottom, self.stroke_roi[2])
+            right = max(right, self.stroke_roi[3])
+        self.stroke_roi = (int(top), int(left), int(bottom), int(right))
+
     def mouseMoveEvent(self, event):
         self.cursor_pos = event.position().toPoint()
         if self.drawing and self.active_label:
@@ -184,6 +259,11 @@ class MaskPainter(QLabel):
             if img_pt is None:
                 return
 
+            if self.mode == 'region':
+                self.fill_region(img_pt)
+                self.update_display()
+                return
+
             size = self.pen_size if self.mode == 'draw' else self.eraser_size
             val = 255 if self.mode == 'draw' else 0
 
@@ -196,13 +276,24 @@ class MaskPainter(QLabel):
             )
 
             self.masks.set(mask=current_mask, label=self.active_label)
+
+            radius = size // 2 + 1
+            self.extend_stroke_roi(
+                min(self.last_point.y(), img_pt.y()) - radius,
+                min(self.last_point.x(), img_pt.x()) - radius,
+                max(self.last_point.y(), img_pt.y()) + radius + 1,
+                max(self.last_point.x(), img_pt.x()) + radius + 1,
+            )
             self.last_point = img_pt
 
         self.update_display()
 
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
+            if self.drawing and self.stroke_roi is not None:
+                self.mask_changed.emit(self.active_label, self.stroke_roi)
             self.drawing = False
+            self.stroke_roi = None
 
     def wheelEvent(self, event):
         angle_delta = event.angleDelta().y()
@@ -239,6 +330,7 @@ class MaskPainter(QLabel):
             self.redo_stack.append(self.current_mask().copy())
             last_mask = self.history.pop()
             self.masks.set(mask=last_mask, label=self.active_label)
+            self.mask_changed.emit(self.active_label, None)
             self.update_display()
 
     def redo(self):
@@ -246,10 +338,11 @@ class MaskPainter(QLabel):
             self.history.append(self.current_mask().copy())
             next_mask = self.redo_stack.pop()
             self.masks.set(mask=next_mask, label=self.active_label)
+            self.mask_changed.emit(self.active_label, None)
             self.update_display()
 
     def set_mode(self, mode):
-        if mode in ('draw', 'erase'):
+        if mode in ('draw', 'erase', 'region'):
             self.mode = mode
 
     def set_pen_size(self, size):
@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ImageCache:
+    """
+    Bounded LRU cache of decoded images with a thread pool prefetcher.
+
+    load is called with an index and returns the decoded image. get returns
+    the image at an index, waiting for it if it is still being loaded, and
+    starts loading the next prefetch images in the navigation direction, so
+    that stepping through the data rarely waits on the disk.
+    """
+
+    def __init__(self, load, max_index: int, cache_size: int = 32, prefetch: int = 4, workers: int = 2):
+        if cache_size <= prefetch:
+            raise ValueError("cache_size must be larger than prefetch.")
+
+        self.load = load
+        self.max_index = max_index
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self.cache = OrderedDict()
+        self.last_index = None
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+
+    def _request(self, index: int):
+        with self._lock:
+            future = self.cache.get(index)
+            if future is None:
+                future = self.executor.submit(self.load, index)
+                self.cache[index] = future
+            self.cache.move_to_end(index)
+
+            while len(self.cache) > self.cache_size:
+                _, oldest = self.cache.popitem(last=False)
+                oldest.cancel()
+
+        return future
+
+    def get(self, index: int):
+        future = self._request(index)
+
+        direction = -1 if self.last_index is not None and index < self.last_index else 1
+        self.last_index = index
+        for step in range(1, self.prefetch + 1):
+            neighbour = index + direction * step
+            if 0 <= neighbour < self.max_index:
+                self._request(neighbour)
+
+        # Requesting the neighbours made them the most recent, keep the current image first
+        with self._lock:
+            if index in self.cache:
+                self.cache.move_to_end(index)
+
+        try:
+            return future.result()
+        except Exception:
+            # Do not keep failures around, the file may be fixed in the meantime
+            with self._lock:
+                if self.cache.get(index) is future:
+                    del self.cache[index]
+            raise
+
+    def clear(self):
+        with self._lock:
+            for future in self.cache.values():
+                future.cancel()
+            self.cache.clear()
+
+    def close(self):
+        """Drops the cached images and stops the prefetch threads."""
+        self.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
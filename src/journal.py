@@ -0,0 +1,270 @@
+import hashlib
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+MAGIC = b"SMCJOURNAL1\n"
+
+# frame, flags, mask height, mask width, roi top, roi left, roi height, roi width, label length
+RECORD_HEADER = struct.Struct("<qBiiiiiiH")
+# payload length and crc32 of the payload
+FRAME_HEADER = struct.Struct("<II")
+
+DELETED = 1
+PROVISIONAL = 2
+# Binary (0/255) regions are stored as packed bits, 8 times less data to compress
+PACKED = 4
+
+
+def read_records(path):
+    """
+    Yields (frame, label, flags, shape, roi, data) for every complete record of a journal.
+
+    Reading stops at the first truncated or corrupt record, which is what a
+    crash in the middle of an append leaves behind.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a mask journal.")
+
+        while True:
+            header = file.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            length, crc = FRAME_HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+
+            frame, flags, h, w, top, left, roi_h, roi_w, label_length = RECORD_HEADER.unpack_from(payload)
+            offset = RECORD_HEADER.size
+            label = payload[offset:offset + label_length].decode("utf-8")
+            data = payload[offset + label_length:]
+
+            yield frame, label, flags, (h, w), (top, left, roi_h, roi_w), data
+
+
+def check_records(path, records, data_loader):
+    """Raises a ValueError if a record edits a frame the data loader does not have."""
+    for frame, *_ in records:
+        if frame < 0 or frame >= data_loader.max_index:
+            raise ValueError(f"{path} edits frame {frame}, but the dataset has "
+                             f"{data_loader.max_index} frames. It belongs to another dataset.")
+
+
+def journal_directory(root: str, data_loader) -> Path:
+    """
+    Folder holding the journals of a dataset.
+
+    It is named after the dataset and keyed on the absolute path it was opened
+    from, so datasets sharing a name, like two annotations.csv files, never
+    share journals.
+    """
+    key = hashlib.sha1(str(data_loader.get_source_path()).encode("utf-8")).hexdigest()[:12]
+    return Path(root) / f"{data_loader.get_output_dir_name()}-{key}"
+
+
+def apply_record(data_loader, frame, label, flags, shape, roi, data):
+    masks = data_loader.get_masks(frame)
+    if flags & DELETED:
+        masks.set(mask=None, label=label)
+    else:
+        mask = masks.get(label)
+        if mask is None or mask.shape != shape:
+            mask = np.zeros(shape, dtype=np.uint8)
+
+        top, left, roi_h, roi_w = roi
+        region = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+        if flags & PACKED:
+            region = np.unpackbits(region, count=roi_h * roi_w) * np.uint8(255)
+        region = region.reshape(roi_h, roi_w)
+        mask[top:top + roi_h, left:left + roi_w] = region
+        masks.set(mask=mask, label=label, provisional=bool(flags & PROVISIONAL))
+
+    data_loader.set_frame_masks(frame, masks)
+
+
+def encode_record(frame, label, masks, roi=None) -> bytes:
+    """Encodes the state of a label mask, or of the roi (top, left, bottom, right) of it."""
+    mask = masks.get(label)
+    label_bytes = label.encode("utf-8")
+
+    if mask is None:
+        header = RECORD_HEADER.pack(frame, DELETED, 0, 0, 0, 0, 0, 0, len(label_bytes))
+        payload = header + label_bytes
+    else:
+        h, w = mask.shape[:2]
+        top, left, bottom, right = roi if roi is not None else (0, 0, h, w)
+        top, left = max(0, top), max(0, left)
+        bottom, right = min(h, bottom), min(w, right)
+        if bottom <= top or right <= left:
+            top, left, bottom, right = 0, 0, 0, 0
+
+        flags = PROVISIONAL if masks.is_provisional(label) else 0
+        region = np.ascontiguousarray(mask[top:bottom, left:right], dtype=np.uint8)
+        binary = cv2.threshold(region, 0, 255, cv2.THRESH_BINARY)[1]
+        if region.size and cv2.norm(region, binary, cv2.NORM_INF) == 0:
+            flags |= PACKED
+            data = np.packbits(binary).tobytes()
+        else:
+            data = region.tobytes()
+
+        header = RECORD_HEADER.pack(frame, flags, h, w, top, left, bottom - top, right - left, len(label_bytes))
+        payload = header + label_bytes + zlib.compress(data, 1)
+
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class MaskJournal:
+    """
+    Append-only journal of the mask edits of one annotation session.
+
+    Every committed change is appended as a record holding the frame, the
+    label, the changed region and its zlib compressed content, and flushed to
+    disk, so a crash loses at most the stroke in progress. replay applies the
+    journal on top of the masks of a freshly opened data loader. The journal
+    is compacted when it is replayed and once it holds compact_every records:
+    it is rewritten with a single full-mask record per edited frame and label,
+    and atomically replaces the old file.
+
+    The journal is kept after the masks are saved. The saved masks are written
+    to a folder the data loaders do not read back, so the journal is what
+    restores the edits when the dataset is opened again.
+
+    Each annotator works on a shard, a name and an optional range of frames,
+    and writes to its own journal file, so several processes can annotate the
+    same dataset without locking. merge_journals combines the shards.
+    """
+
+    def __init__(self, directory: str, data_loader, shard: str = "default",
+                 frame_range=None, compact_every: int = 500):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f"{shard}.journal"
+
+        self.data_loader = data_loader
+        self.shard = shard
+        self.frame_range = frame_range
+        self.compact_every = compact_every
+
+        self.edited = set()
+        self.records = 0
+        self.file = None
+
+    def in_shard(self, frame: int) -> bool:
+        if self.frame_range is None:
+            return True
+        start, end = self.frame_range
+        return start <= frame <= end
+
+    def replay(self) -> int:
+        """
+        Applies the journal to the data loader and opens it for appending. Returns the number of records.
+
+        Raises a ValueError without applying anything if the journal edits
+        frames the data loader does not have.
+        """
+        if self.path.exists():
+            records = list(read_records(self.path))
+            # Nothing is applied from a journal of another dataset
+            check_records(self.path, records, self.data_loader)
+
+            valid_size = len(MAGIC)
+            for record in records:
+                apply_record(self.data_loader, *record)
+                self.edited.add((record[0], record[1]))
+                self.records += 1
+                valid_size += FRAME_HEADER.size + RECORD_HEADER.size + len(record[1].encode("utf-8")) + len(record[5])
+
+            # Drop a record left half written by a crash, so new records follow valid ones
+            with open(self.path, "r+b") as file:
+                file.truncate(valid_size)
+        else:
+            with open(self.path, "wb") as file:
+                file.write(MAGIC)
+
+        self.file = open(self.path, "ab")
+        restored = self.records
+
+        # Start every session from a compact journal, so it does not grow across sessions
+        if self.records > len(self.edited):
+            self.compact()
+        return restored
+
+    def record(self, frame: int, label: str, roi=None):
+        """Appends the state of a label mask of a frame, limited to roi (top, left, bottom, right) if given."""
+        self.append([(frame, label, roi)])
+
+    def record_many(self, frames, label: str):
+        """Appends the full label masks of several frames, synced to disk once."""
+        self.append([(frame, label, None) for frame in frames])
+
+    def append(self, changes):
+        if self.file is None:
+            raise ValueError("The journal must be replayed before recording.")
+        for frame, _, _ in changes:
+            if not self.in_shard(frame):
+                raise ValueError(f"Frame {frame} is outside of shard {self.shard}.")
+        if not changes:
+            return
+
+        for frame, label, roi in changes:
+            self.file.write(encode_record(frame, label, self.data_loader.get_masks(frame), roi))
+            self.edited.add((frame, label))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        self.records += len(changes)
+        if self.records >= self.compact_every and self.records > 2 * len(self.edited):
+            self.compact()
+
+    def compact(self):
+        """Rewrites the journal with one full-mask record per edited frame and label."""
+        temp_path = self.path.with_suffix(".compact")
+        with open(temp_path, "wb") as file:
+            file.write(MAGIC)
+            for frame, label in sorted(self.edited):
+                file.write(encode_record(frame, label, self.data_loader.get_masks(frame)))
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.file.close()
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, "ab")
+        self.records = len(self.edited)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def merge_journals(directory: str, data_loader) -> list:
+    """
+    Replays the journals of all shards of a dataset into a data loader.
+
+    The shards must have edited disjoint frames of the data loader, a frame
+    edited in several shards or past the end of the dataset raises a
+    ValueError before anything is applied. Returns the names of the merged
+    shards.
+    """
+    paths = sorted(Path(directory).glob("*.journal"))
+    shards = {path: list(read_records(path)) for path in paths}
+
+    owners = {}
+    for path, records in shards.items():
+        check_records(path, records, data_loader)
+        for frame, *_ in records:
+            owner = owners.setdefault(frame, path.stem)
+            if owner != path.stem:
+                raise ValueError(f"Frame {frame} was edited in shards {owner} and {path.stem}.")
+
+    for records in shards.values():
+        for record in records:
+            apply_record(data_loader, *record)
+
+    return [path.stem for path in paths]
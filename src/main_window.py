@@ -1,14 +1,14 @@
 import os
 import sys
+from pathlib import Path
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QComboBox, QFileDialog, QMessageBox,
     QLabel, QScrollArea, QSlider
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 
 from src.components import MaskPainter
-from src.utils import VideoDataLoader, ImageDataLoader
 
 from PySide6.QtGui import QKeySequence, QShortcut
 
@@ -21,6 +21,9 @@ class MainWindow(QWidget):
         self.config = config
         app_type = config.get("application", "Image")
 
+        self.mode_buttons = []
+        # Only the video mode propagates masks
+        self.propagator = None
         if app_type == "Image":
             self.load_button, self.slider = self.init_image_mode()
         elif app_type == "Video":
@@ -28,6 +31,9 @@ class MainWindow(QWidget):
 
 
         self.data_loader = None
+        self.journal = None
+        # Created with each dataset, it is only needed once frames are shown
+        self.superpixels = None
 
         # Shortcut to go to previous frame
         self.shortcut_prev_frame = QShortcut(QKeySequence("N"), self)
@@ -41,6 +47,7 @@ class MainWindow(QWidget):
 
 
         self.canvas = MaskPainter(labels=self.labels)
+        self.canvas.mask_changed.connect(self.record_change)
         self.scroll_area = QScrollArea()
         self.scroll_area.setWidgetResizable(True)
         self.scroll_area.setWidget(self.canvas)
@@ -83,24 +90,32 @@ class MainWindow(QWidget):
 
         self.draw_btn = QPushButton("Draw")
         self.erase_btn = QPushButton("Erase")
+        self.region_btn = QPushButton("Region")
         self.undo_btn = QPushButton("Undo")
         self.redo_btn = QPushButton("Redo")
         self.delete_btn = QPushButton("Delete Mask")
+        self.confirm_btn = QPushButton("Confirm Mask")
         self.save_btn = QPushButton("Save Masks")
+        self.merge_btn = QPushButton("Merge Shards")
 
         self.draw_btn.clicked.connect(lambda: self.canvas.set_mode('draw'))
         self.erase_btn.clicked.connect(lambda: self.canvas.set_mode('erase'))
+        self.region_btn.clicked.connect(lambda: self.canvas.set_mode('region'))
         self.undo_btn.clicked.connect(self.canvas.undo)
         self.redo_btn.clicked.connect(self.canvas.redo)
         self.delete_btn.clicked.connect(self.delete_current_mask)
+        self.confirm_btn.clicked.connect(self.canvas.confirm_current_mask)
         self.save_btn.clicked.connect(self.save_masks)
+        self.merge_btn.clicked.connect(self.merge_shards)
 
         # Set a shortcut for the draw button
         self.draw_btn.setShortcut("B")
         self.erase_btn.setShortcut("E")
+        self.region_btn.setShortcut("R")
         self.undo_btn.setShortcut("Ctrl+Z")
         self.redo_btn.setShortcut("Ctrl+Y")
         self.delete_btn.setShortcut("Ctrl+D")
+        self.confirm_btn.setShortcut("Ctrl+K")
 
         self.brush_slider = QSlider(Qt.Horizontal)
         self.brush_slider.setRange(1, 50)
@@ -123,10 +138,15 @@ class MainWindow(QWidget):
         controls_layout.addWidget(self.brush_slider)
         controls_layout.addWidget(self.draw_btn)
         controls_layout.addWidget(self.erase_btn)
+        controls_layout.addWidget(self.region_btn)
         controls_layout.addWidget(self.undo_btn)
         controls_layout.addWidget(self.redo_btn)
         controls_layout.addWidget(self.delete_btn)
+        controls_layout.addWidget(self.confirm_btn)
+        for button in self.mode_buttons:
+            controls_layout.addWidget(button)
         controls_layout.addWidget(self.save_btn)
+        controls_layout.addWidget(self.merge_btn)
 
         main_layout = QVBoxLayout(self)
         main_layout.addWidget(self.load_button)
@@ -151,6 +171,47 @@ class MainWindow(QWidget):
         frame_slider.setPageStep(1)
         frame_slider.valueChanged.connect(self.load_image)
 
+        interpolate_btn = QPushButton("Interpolate")
+        interpolate_btn.setShortcut("I")
+        interpolate_btn.clicked.connect(self.interpolate_masks)
+
+        propagate_back_btn = QPushButton("Propagate <<")
+        propagate_back_btn.setShortcut("Shift+P")
+        propagate_back_btn.clicked.connect(lambda: self.propagate_mask(-1))
+
+        propagate_forward_btn = QPushButton("Propagate >>")
+        propagate_forward_btn.setShortcut("P")
+        propagate_forward_btn.clicked.connect(lambda: self.propagate_mask(1))
+
+        self.play_btn = QPushButton("Play")
+        self.play_btn.clicked.connect(self.toggle_playback)
+        self.shortcut_play = QShortcut(QKeySequence("Space"), self)
+        self.shortcut_play.activated.connect(self.toggle_playback)
+
+        self.speed_selector = QComboBox()
+        self.speed_selector.addItems(["1x", "2x", "4x"])
+
+        self.playback_stats = QLabel("")
+
+        self.mode_buttons = [
+            interpolate_btn, propagate_back_btn, propagate_forward_btn,
+            self.play_btn, self.speed_selector, self.playback_stats
+        ]
+
+        # Playback decodes in the background, the timer shows the frames that are due
+        self.player = None
+        self.playback_timer = QTimer(self)
+        self.playback_timer.setTimerType(Qt.PreciseTimer)
+        self.playback_timer.timeout.connect(self.show_next_frame)
+
+        # Propagation runs in the background, its results are collected on a timer
+        self.propagation_timer = QTimer(self)
+        self.propagation_timer.setInterval(100)
+        self.propagation_timer.timeout.connect(self.collect_propagation)
+
+        self.shortcut_cancel_propagation = QShortcut(QKeySequence("Escape"), self)
+        self.shortcut_cancel_propagation.activated.connect(self.cancel_propagation)
+
         return load_video_btn, frame_slider
 
 
@@ -172,9 +233,101 @@ class MainWindow(QWidget):
         csv_file, _ = QFileDialog.getOpenFileName(self, "Open CSV File", "", "CSV Files (*.csv)")
         if not csv_file:
             return
-        self.data_loader = ImageDataLoader(csv_file, self.labels)
-        self.slider.setRange(0, self.data_loader.max_index - 1)
-        self.current_index = 0
+
+        # Imported here so that only the modules of the chosen application mode are loaded
+        from src.utils import ImageDataLoader
+
+        self.open_data_loader(ImageDataLoader(csv_file, self.labels))
+
+    def open_data_loader(self, data_loader):
+        from src.superpixels import SuperpixelIndex
+
+        # A running propagation belongs to the frames of the previous dataset
+        self.stop_propagation()
+
+        # Stop the background threads and release the files of the previous dataset
+        if self.data_loader is not None:
+            self.data_loader.close()
+        if self.superpixels is not None:
+            self.superpixels.close()
+
+        self.data_loader = data_loader
+        self.superpixels = SuperpixelIndex(region_size=self.config.get("superpixel_size", 20))
+        self.open_journal()
+
+        first, last = self.frame_range()
+        self.current_index = first
+
+        # Show the first frame with its own masks, so that the blank masks of
+        # the canvas are never stored over the loaded or restored ones
+        self.canvas.set_masks(self.data_loader.get_masks(first))
+        self.slider.blockSignals(True)
+        self.slider.setRange(first, last)
+        self.slider.setValue(first)
+        self.slider.blockSignals(False)
+        self.load_image(first)
+
+    def frame_range(self):
+        """First and last frame this annotator works on."""
+        last = self.data_loader.max_index - 1
+        shard_frames = self.config.get("shard_frames")
+        if not shard_frames:
+            return 0, last
+        return max(0, shard_frames[0]), min(last, shard_frames[1])
+
+    def open_journal(self):
+        from src.journal import MaskJournal, journal_directory
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+        shard = self.config.get("shard", "default")
+        directory = journal_directory(self.config.get("journal_dir", "journals"), self.data_loader)
+        journal = None
+        try:
+            journal = MaskJournal(directory, self.data_loader, shard=shard, frame_range=self.frame_range())
+            restored = journal.replay()
+        except (ValueError, OSError) as e:
+            # The dataset stays usable, only without crash safety
+            if journal is not None:
+                journal.close()
+            QMessageBox.warning(self, "Journal",
+                                f"The journal could not be restored, edits will not be journaled:\n{e}")
+            return
+
+        self.journal = journal
+        if restored:
+            QMessageBox.information(self, "Journal",
+                                    f"Restored {restored} edits of shard {shard} from:\n{self.journal.path}")
+
+    def record_change(self, label, roi=None):
+        if self.journal is None:
+            return
+        try:
+            self.journal.record(self.current_index, label, roi)
+        except ValueError as e:
+            # Never lose crash safety silently
+            QMessageBox.warning(self, "Journal", f"The change was not journaled:\n{e}")
+
+    def merge_shards(self):
+        if self.data_loader is None:
+            return
+
+        from src.journal import journal_directory, merge_journals
+
+        self.data_loader.set_frame_masks(self.current_index, self.canvas.masks)
+        directory = journal_directory(self.config.get("journal_dir", "journals"), self.data_loader)
+        try:
+            shards = merge_journals(directory, self.data_loader)
+        except ValueError as e:
+            QMessageBox.warning(self, "Merge Shards", str(e))
+            return
+
+        self.canvas.set_masks(self.data_loader.get_masks(self.current_index))
+        self.canvas.update_display()
+        QMessageBox.information(self, "Merge Shards",
+                                f"Merged the edits of shards: {', '.join(shards)}")
 
     def load_image(self, index):
         # Placeholder for loading image logic
@@ -185,6 +338,7 @@ class MainWindow(QWidget):
         current_frame = self.slider.value()
         if current_frame in self.data_loader.masks:
             self.data_loader.delete_mask(current_frame, self.canvas.active_label)
+            self.record_change(self.canvas.active_label)
             self.canvas.set_masks(self.data_loader.get_masks(current_frame))
             self.canvas.update_display()
         else:
@@ -236,12 +390,10 @@ class MainWindow(QWidget):
         if not video_dir:
             return
         
-        self.video = video_dir
-        self.data_loader = VideoDataLoader(video_dir, self.labels)
-        self.slider.setRange(0, self.data_loader.max_index - 1)
-        self.current_index = 0
+        from src.utils import VideoDataLoader
 
-        self.canvas.update_display()
+        self.video = video_dir
+        self.open_data_loader(VideoDataLoader(video_dir, self.labels))
 
     def load_image(self, image_index):
         if self.data_loader is None:
@@ -253,6 +405,7 @@ class MainWindow(QWidget):
 
         self.current_frame = self.data_loader.get_datapoint(image_index)
         self.canvas.set_image(self.current_frame)
+        self.canvas.set_superpixels(self.superpixels.request(image_index, self.current_frame))
 
         current_masks = self.data_loader.get_masks(image_index)
         self.canvas.set_masks(current_masks)
@@ -262,6 +415,213 @@ class MainWindow(QWidget):
 
         self.canvas.update_display()
 
+    def interpolate_masks(self):
+        if self.data_loader is None:
+            return
+
+        # Make sure the edits on the current frame are used as keyframes
+        self.data_loader.set_frame_masks(self.current_index, self.canvas.masks)
+
+        try:
+            generated = self.data_loader.interpolate_masks(
+                self.canvas.active_label, frame_range=self.frame_range()
+            )
+        except ValueError as e:
+            QMessageBox.warning(self, "Interpolate", str(e))
+            return
+
+        if self.journal is not None:
+            self.journal.record_many(generated, self.canvas.active_label)
+
+        self.canvas.set_masks(self.data_loader.get_masks(self.current_index))
+        self.canvas.update_display()
+
+        QMessageBox.information(self, "Interpolate",
+                                f"Generated {len(generated)} provisional masks.")
+
+    def propagate_mask(self, direction):
+        if self.data_loader is None:
+            return
+        if self.propagator is not None:
+            QMessageBox.warning(self, "Propagate", "A propagation is already running, press Escape to cancel it.")
+            return
+
+        from src.propagation import MaskPropagator
+
+        self.data_loader.set_frame_masks(self.current_index, self.canvas.masks)
+
+        # Stay within the frames of this annotator
+        first, last = self.frame_range()
+        max_frames = last - self.current_index if direction == 1 else self.current_index - first
+        if max_frames <= 0:
+            return
+
+        try:
+            self.propagator = MaskPropagator(
+                self.data_loader,
+                label=self.canvas.active_label,
+                start_frame=self.current_index,
+                mask=self.canvas.masks.get(self.canvas.active_label),
+                direction=direction,
+                max_frames=max_frames,
+            )
+        except ValueError as e:
+            QMessageBox.warning(self, "Propagate", str(e))
+            return
+
+        self.propagated_frames = 0
+        self.propagator.start()
+        self.propagation_timer.start()
+
+    def cancel_propagation(self):
+        if self.propagator is not None:
+            self.propagator.cancel()
+
+    def stop_propagation(self):
+        """Cancels a running propagation and drops its remaining results."""
+        if self.propagator is None:
+            return
+        self.propagator.cancel()
+        self.propagation_timer.stop()
+        self.propagator = None
+
+    def collect_propagation(self):
+        propagator = self.propagator
+        data_loader = propagator.data_loader
+        # Never write the masks of one dataset into another
+        current = data_loader is self.data_loader
+
+        finished = False
+        collected = []
+        while not propagator.results.empty():
+            result = propagator.results.get()
+            if result is None:
+                finished = True
+                break
+
+            frame_number, mask, _ = result
+            if propagator.is_cancelled() or not current:
+                continue
+
+            # The annotator may have edited frames ahead since the propagation started,
+            # the results past such a frame are discarded as well
+            frame_masks = data_loader.frame_masks(frame_number)
+            if frame_masks.get(propagator.label) is not None and not frame_masks.is_provisional(propagator.label):
+                propagator.cancel()
+                continue
+
+            frame_masks.set(mask=mask, label=propagator.label, provisional=True)
+            collected.append(frame_number)
+            self.propagated_frames += 1
+
+            if frame_number == self.current_index:
+                self.canvas.update_display()
+
+        if collected and self.journal is not None:
+            try:
+                self.journal.record_many(collected, propagator.label)
+            except ValueError as e:
+                propagator.cancel()
+                QMessageBox.warning(self, "Journal", f"The propagated masks were not journaled:\n{e}")
+
+        if not finished:
+            return
+
+        self.propagation_timer.stop()
+        self.propagator = None
+
+        if propagator.error is not None:
+            QMessageBox.warning(self, "Propagate", str(propagator.error))
+            return
+
+        message = f"Propagated {propagator.label} to {self.propagated_frames} frames."
+        if propagator.last_confidence is not None and propagator.last_confidence < propagator.min_confidence:
+            message += f"\nStopped at low confidence ({propagator.last_confidence:.2f})."
+        QMessageBox.information(self, "Propagate", message)
+
+    def toggle_playback(self):
+        if self.data_loader is None:
+            return
+        if self.player is not None:
+            self.stop_playback()
+            return
+
+        from src.playback import FramePlayer
+
+        # Keep the edits of the current frame, playback reads the stored masks
+        self.data_loader.set_frame_masks(self.current_index, self.canvas.masks)
+
+        speed = float(self.speed_selector.currentText().rstrip("x"))
+        self.player = FramePlayer(
+            self.data_loader,
+            start_frame=self.current_index,
+            colors=self.canvas.overlay_colors(),
+            speed=speed,
+            end_frame=self.frame_range()[1],
+        )
+        self.player.start()
+
+        self.set_editing_enabled(False)
+        self.play_btn.setText("Pause")
+        self.playback_timer.start(max(1, int(1000 / (2 * self.player.rate))))
+
+    def set_editing_enabled(self, enabled):
+        """Locks every control that edits masks or changes the frame, used during playback."""
+        widgets = [
+            self.canvas, self.load_button, self.slider, self.brush_slider,
+            self.draw_btn, self.erase_btn, self.region_btn, self.undo_btn, self.redo_btn,
+            self.delete_btn, self.confirm_btn, self.save_btn, self.merge_btn,
+        ]
+        widgets += [widget for widget in self.mode_buttons
+                    if widget not in (self.play_btn, self.speed_selector, self.playback_stats)]
+        for widget in widgets:
+            widget.setEnabled(enabled)
+
+        # Buttons lose their shortcuts when disabled, the standalone shortcuts do not
+        for shortcut in (self.shortcut_prev_frame, self.shortcut_next_frame,
+                         self.shortcut_increase_brush, self.shortcut_decrease_brush):
+            shortcut.setEnabled(enabled)
+
+    def show_next_frame(self):
+        result = self.player.next_frame()
+        if result is not None:
+            frame_number, image = result
+            self.canvas.show_composited(image)
+
+            # Move the slider without loading the frame for editing
+            self.slider.blockSignals(True)
+            self.slider.setValue(frame_number)
+            self.slider.blockSignals(False)
+
+        if self.player.finished:
+            self.stop_playback()
+
+    def stop_playback(self):
+        player = self.player
+        player.stop()
+        self.player = None
+        self.playback_timer.stop()
+
+        self.set_editing_enabled(True)
+        self.play_btn.setText("Play")
+
+        total = player.shown + player.dropped
+        dropped_percent = 100 * player.dropped / total if total else 0
+        self.playback_stats.setText(
+            f"Shown {player.shown}, dropped {player.dropped} ({dropped_percent:.1f}%)"
+        )
+
+        # Load the last shown frame for editing, within the frames of this annotator
+        first, last = self.frame_range()
+        last_frame = min(max(player.last_frame, first), last)
+        self.slider.blockSignals(True)
+        self.slider.setValue(last_frame)
+        self.slider.blockSignals(False)
+        self.load_image(last_frame)
+
+        if player.error is not None:
+            QMessageBox.warning(self, "Play", f"Playback stopped at an error:\n{player.error}")
+
     def change_label(self, label_name):
         self.canvas.set_active_label(label_name)
 
@@ -282,8 +642,11 @@ class MainWindow(QWidget):
 
         self.data_loader.save_all_masks(folder)
 
-        QMessageBox.information(self, "Save Masks",
-                                f"Saved masks to:\n{folder}")
+        message = f"Saved masks to:\n{folder}"
+        provisional = sum(len(masks.provisional) for masks in self.data_loader.masks.values())
+        if provisional:
+            message += f"\n\nSkipped {provisional} provisional masks that are not confirmed yet."
+        QMessageBox.information(self, "Save Masks", message)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+import csv
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+
+class CsvManifest:
+    """
+    Row index over a CSV file with O(1) lookup of a row by its index.
+
+    The file is scanned once in binary chunks with numpy and only the byte
+    offset of every row is kept, 8 bytes per row, so opening a manifest with
+    millions of rows is fast and does not hold its content in memory. Rows
+    are parsed on demand with the csv module. Quoted fields spanning several
+    lines are supported.
+    """
+
+    def __init__(self, path: str, encoding: str = "utf-8-sig", chunk_size: int = 1 << 20):
+        self.path = Path(path)
+        self.encoding = encoding
+
+        self.offsets = array("q")
+
+        with open(self.path, "rb") as file:
+            header = file.readline()
+            self.columns = next(csv.reader([header.decode(self.encoding)]))
+            self._scan(file, file.tell(), chunk_size)
+
+    def _scan(self, file, start: int, chunk_size: int):
+        position = start
+        parity = 0
+        # Row start at the very end of the previous chunk, checked against the next byte
+        pending = start
+
+        file.seek(start)
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            data = np.frombuffer(chunk, dtype=np.uint8)
+
+            if pending is not None and data[0] not in (10, 13):
+                self.offsets.append(pending)
+            pending = None
+
+            # Line breaks inside quoted fields do not start a new row
+            quotes = np.cumsum(data == 34) + parity
+            breaks = np.flatnonzero((data == 10) & (quotes % 2 == 0)) + 1
+            parity = int(quotes[-1] % 2)
+
+            if len(breaks) and breaks[-1] == len(data):
+                pending = position + len(data)
+                breaks = breaks[:-1]
+
+            # Skip blank lines
+            breaks = breaks[(data[breaks] != 10) & (data[breaks] != 13)]
+            self.offsets.extend((breaks + position).tolist())
+
+            position += len(data)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _read_record(self, offset: int) -> str:
+        # The file is opened per lookup, so no handle is left open and the
+        # prefetch threads can read rows concurrently
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            lines = []
+            quotes = 0
+            while True:
+                line = file.readline()
+                lines.append(line)
+                quotes += line.count(b'"')
+                if not line or quotes % 2 == 0:
+                    break
+        return b"".join(lines).decode(self.encoding)
+
+    def row(self, index: int) -> dict:
+        """Returns the row at index as a dict from column name to value."""
+        if index < 0 or index >= len(self.offsets):
+            raise ValueError(f"Index {index} is out of range.")
+
+        record = self._read_record(self.offsets[index])
+
+        values = next(csv.reader([record]), [])
+        return dict(zip(self.columns, values))
+
+    def __iter__(self):
+        """Iterates over all rows sequentially, without seeking."""
+        with open(self.path, "r", encoding=self.encoding, newline="") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for values in reader:
+                if values:
+                    yield dict(zip(self.columns, values))
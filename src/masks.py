@@ -0,0 +1,54 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Set
+
+
+@dataclass
+class ImageMasks:
+    labels: List[str]
+    image_index: int = None
+    save_name: Any = None
+    masks: Dict[str, Any] = field(init=False)
+    provisional: Set[str] = field(init=False)
+
+    def __post_init__(self):
+        if not self.labels:
+            raise ValueError("labels list must be non-empty")
+        # Initialize all labels with None
+        self.masks = {label: None for label in self.labels}
+        # Labels whose mask was generated and not yet confirmed by the annotator
+        self.provisional = set()
+
+    def set_index(self, image_index: int):
+        self.image_index = image_index
+
+    def set(self, mask: Any, label: str, provisional: bool = False):
+        if label not in self.masks:
+            return
+        self.masks[label] = mask
+        # Any direct edit counts as a confirmation of the mask
+        if provisional and mask is not None:
+            self.provisional.add(label)
+        else:
+            self.provisional.discard(label)
+
+    def is_provisional(self, label: str) -> bool:
+        return label in self.provisional
+
+    def confirm(self, label: str):
+        self.provisional.discard(label)
+
+    def get(self, label: str):
+        return self.masks.get(label, None)
+
+    def get_index(self):
+        return self.image_index
+
+    def get_all(self) -> Dict[str, Any]:
+        """Returns all label-mask pairs."""
+        return self.masks
+
+    def set_save_name(self, save_name: str):
+        self.save_name = save_name
+
+    def get_save_name(self):
+        return self.save_name
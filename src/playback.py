@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def composite_masks(frame, masks, colors: dict):
+    """
+    Blends the masks of a frame over it and returns an RGB image.
+
+    colors maps each label to draw to an (r, g, b, a) tuple, provisional
+    masks are drawn with half the alpha like on the canvas.
+    """
+    image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if masks is None:
+        return image
+
+    for label, (r, g, b, a) in colors.items():
+        mask = masks.get(label)
+        if mask is None:
+            continue
+        if masks.is_provisional(label):
+            a = a // 2
+
+        selected = mask > 0
+        alpha = a / 255.0
+        blended = image[selected] * (1.0 - alpha) + np.array([r, g, b]) * alpha
+        image[selected] = blended.astype(np.uint8)
+
+    return image
+
+
+class FramePlayer:
+    """
+    Plays a video of a VideoDataLoader with its masks in real time.
+
+    A decoder thread reads the frames sequentially, composites their masks
+    and puts them on a bounded queue. The player keeps its own clock at the
+    source frame rate times speed: frames that are already late when they are
+    decoded are only grabbed, not decoded nor composited, and next_frame drops
+    every queued frame that is older than the frame due on the clock. The
+    number of shown and dropped frames is kept in shown and dropped.
+    Playback stops after end_frame, the last frame of the video by default,
+    or at a decoding error, which is kept in error.
+    """
+
+    def __init__(self, data_loader, start_frame: int, colors: dict,
+                 speed: float = 1.0, queue_size: int = 8, end_frame: int = None):
+        if start_frame < 0 or start_frame >= data_loader.max_index:
+            raise ValueError(f"Frame number {start_frame} is out of range.")
+        if end_frame is None:
+            end_frame = data_loader.max_index - 1
+        if end_frame < start_frame or end_frame >= data_loader.max_index:
+            raise ValueError(f"Frame number {end_frame} is out of range.")
+        if speed <= 0:
+            raise ValueError("speed must be positive.")
+
+        self.data_loader = data_loader
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.colors = colors
+        self.rate = data_loader.fps * speed
+
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.shown = 0
+        # Counted separately since the decoder and the display run in different threads
+        self.decoder_dropped = 0
+        self.display_dropped = 0
+        self.finished = False
+        self.last_frame = start_frame
+        self.error = None
+
+        self._pending = None
+        self.start_time = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def dropped(self) -> int:
+        return self.decoder_dropped + self.display_dropped
+
+    def due_frame(self) -> int:
+        """Frame that should be on screen according to the playback clock."""
+        return self.start_frame + int((time.perf_counter() - self.start_time) * self.rate)
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._decode, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _put(self, item):
+        # Block on a full queue, but wake up regularly to notice a stop
+        while not self._stop.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _decode(self):
+        video = cv2.VideoCapture(str(self.data_loader.video_path))
+        try:
+            video.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+            for frame_number in range(self.start_frame, self.end_frame + 1):
+                if self._stop.is_set():
+                    return
+                if not video.grab():
+                    break
+
+                if frame_number < self.due_frame():
+                    self.decoder_dropped += 1
+                    continue
+
+                ret, frame = video.retrieve()
+                if not ret:
+                    break
+
+                masks = self.data_loader.masks.get(frame_number)
+                self._put((frame_number, composite_masks(frame, masks, self.colors)))
+        except Exception as e:
+            # Reported by the GUI, so playback does not end as if the video did
+            self.error = e
+        finally:
+            video.release()
+            self._put((None, None))
+
+    def next_frame(self):
+        """
+        Returns the newest (frame_number, image) that is due, dropping older ones.
+
+        Returns None if no new frame is due yet, finished is set once the
+        end of the video has been played.
+        """
+        due = self.due_frame()
+        latest = None
+        while True:
+            if self._pending is None:
+                try:
+                    self._pending = self.frames.get_nowait()
+                except queue.Empty:
+                    break
+
+            frame_number, _ = self._pending
+            if frame_number is None:
+                if latest is None:
+                    self.finished = True
+                break
+            if frame_number > due:
+                break
+
+            if latest is not None:
+                self.display_dropped += 1
+            latest = self._pending
+            self._pending = None
+
+        if latest is not None:
+            self.shown += 1
+            self.last_frame = latest[0]
+        return latest
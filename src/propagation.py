@@ -0,0 +1,155 @@
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+
+def to_flow_image(frame, flow_width: int):
+    """Converts a BGR frame to the reduced resolution grayscale image used for the flow."""
+    h, w = frame.shape[:2]
+    scale = min(1.0, flow_width / w)
+    small = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))),
+                       interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def sampling_grid(h: int, w: int):
+    grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+    return grid_x, grid_y
+
+
+def warp_with_flow(image, flow, grid, interpolation=cv2.INTER_LINEAR):
+    """Samples image at (x, y) + flow(x, y) for every pixel of the flow."""
+    grid_x, grid_y = grid
+    return cv2.remap(image, grid_x + flow[..., 0], grid_y + flow[..., 1],
+                     interpolation, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+class MaskPropagator:
+    """
+    Propagates a mask from a frame to its neighbours using dense optical flow.
+
+    The propagation runs in a background thread that streams the frames of a
+    VideoDataLoader in one direction. The flow is computed with DIS on frames
+    reduced to flow_width pixels and only upscaled to warp the mask. Each
+    propagated mask is given a confidence, the fraction of its pixels whose
+    forward and backward flow agree, and the propagation stops as soon as the
+    confidence drops below min_confidence, when it reaches a frame with a
+    confirmed mask for the label, or when it is cancelled.
+
+    Results are put on the results queue as (frame_number, mask, confidence)
+    tuples, followed by None once the propagation has finished.
+    """
+
+    def __init__(self, data_loader, label: str, start_frame: int, mask,
+                 direction: int = 1, max_frames: int = None,
+                 min_confidence: float = 0.6, flow_width: int = 320,
+                 consistency_threshold: float = 1.0):
+        if mask is None:
+            raise ValueError(f"Frame {start_frame} has no {label} mask to propagate.")
+        if direction not in (1, -1):
+            raise ValueError("direction must be 1 or -1.")
+
+        self.data_loader = data_loader
+        self.label = label
+        self.start_frame = start_frame
+        self.mask = mask.copy()
+        self.direction = direction
+        self.max_frames = max_frames
+        self.min_confidence = min_confidence
+        self.flow_width = flow_width
+        self.consistency_threshold = consistency_threshold
+
+        # Snapshot of the frames that must not be overwritten, so the worker
+        # never reads the masks the GUI thread is editing
+        self.stop_frames = {
+            index for index, masks in data_loader.masks.items()
+            if index != start_frame and masks.get(label) is not None and not masks.is_provisional(label)
+        }
+
+        self.results = queue.Queue()
+        self.last_confidence = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        try:
+            self._propagate()
+        except Exception as e:
+            # Reported by the GUI, OpenCV errors included
+            self.error = e
+        finally:
+            self.results.put(None)
+
+    def _propagate(self):
+        dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_FAST)
+        frames = self.data_loader.stream_frames(self.start_frame, self.direction)
+
+        mask = self.mask
+        h, w = mask.shape[:2]
+        full_grid = sampling_grid(h, w)
+        small_grid = None
+        previous = None
+        count = 0
+
+        for frame_number, frame in frames:
+            if self._cancel.is_set():
+                return
+
+            current = to_flow_image(frame, self.flow_width)
+            if previous is None:
+                previous = current
+                small_grid = sampling_grid(*current.shape[:2])
+                continue
+
+            if frame_number in self.stop_frames:
+                return
+
+            # Backward flow tells where each pixel of the new frame comes from
+            flow_back = dis.calc(current, previous, None)
+            flow_forward = dis.calc(previous, current, None)
+
+            small_mask = cv2.resize(mask, (current.shape[1], current.shape[0]),
+                                    interpolation=cv2.INTER_NEAREST)
+            warped_small = warp_with_flow(small_mask, flow_back, small_grid) > 127
+
+            # Forward-backward consistency of the flow inside the propagated mask
+            round_trip = flow_back + warp_with_flow(flow_forward, flow_back, small_grid)
+            consistent = np.linalg.norm(round_trip, axis=2) < self.consistency_threshold
+            area = np.count_nonzero(warped_small)
+            confidence = float(np.count_nonzero(consistent & warped_small)) / area if area else 0.0
+            self.last_confidence = confidence
+
+            if confidence < self.min_confidence:
+                return
+
+            scale_x = w / current.shape[1]
+            scale_y = h / current.shape[0]
+            flow_full = cv2.resize(flow_back, (w, h), interpolation=cv2.INTER_LINEAR)
+            flow_full[..., 0] *= scale_x
+            flow_full[..., 1] *= scale_y
+
+            warped = warp_with_flow(mask, flow_full, full_grid)
+            mask = cv2.threshold(warped, 127, 255, cv2.THRESH_BINARY)[1]
+
+            self.results.put((frame_number, mask, confidence))
+            previous = current
+
+            count += 1
+            if self.max_frames is not None and count >= self.max_frames:
+                return
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+def compute_superpixels(image, region_size: int = 20):
+    """
+    Oversegments a BGR image into superpixels and returns an int32 label map.
+
+    Uses SLIC from opencv-contrib when it is installed, otherwise a watershed
+    seeded on a regular grid of region_size pixels, which only needs the base
+    OpenCV package.
+    """
+    if hasattr(cv2, "ximgproc"):
+        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+        slic = cv2.ximgproc.createSuperpixelSLIC(lab, algorithm=cv2.ximgproc.SLICO,
+                                                 region_size=region_size)
+        slic.iterate(5)
+        return slic.getLabels().astype(np.int32)
+
+    h, w = image.shape[:2]
+    markers = np.zeros((h, w), dtype=np.int32)
+    ys = np.arange(region_size // 2, h, region_size)
+    xs = np.arange(region_size // 2, w, region_size)
+    grid_y, grid_x = np.meshgrid(ys, xs, indexing="ij")
+    markers[grid_y, grid_x] = np.arange(1, grid_y.size + 1).reshape(grid_y.shape)
+
+    smoothed = cv2.GaussianBlur(image, (5, 5), 0)
+    labels = cv2.watershed(smoothed, markers)
+
+    # Watershed marks the boundaries with -1, give them to a neighbouring region
+    kernel = np.ones((3, 3), np.uint8)
+    for _ in range(region_size):
+        boundaries = labels <= 0
+        if not boundaries.any():
+            break
+        grown = cv2.dilate(labels.astype(np.float32), kernel)
+        labels[boundaries] = grown[boundaries].astype(np.int32)
+
+    return np.maximum(labels, 1) - 1
+
+
+class SuperpixelMap:
+    """A superpixel label map indexed so that a region lookup touches only its own pixels."""
+
+    def __init__(self, labels):
+        self.labels = labels
+        flat = labels.ravel()
+        self.order = np.argsort(flat, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(flat))])
+
+    def label_at(self, x: int, y: int) -> int:
+        return int(self.labels[y, x])
+
+    def region(self, label: int):
+        """Flat pixel indices of a superpixel."""
+        return self.order[self.offsets[label]:self.offsets[label + 1]]
+
+    def fill(self, mask, x: int, y: int, value: int = 255) -> int:
+        """Sets the superpixel under (x, y) in the mask to value and returns its label."""
+        label = self.label_at(x, y)
+        mask.flat[self.region(label)] = value
+        return label
+
+
+class SuperpixelIndex:
+    """
+    Computes superpixel maps in a background thread and caches them by frame index.
+
+    request returns a future, so a frame can be oversegmented as soon as it is
+    loaded. Requesting a frame cancels the pending maps of the other frames,
+    so stepping through frames never builds up a backlog.
+    """
+
+    def __init__(self, region_size: int = 20, cache_size: int = 32):
+        self.region_size = region_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def request(self, index: int, image):
+        # Only the frame on screen matters, drop the maps not started yet
+        for other, future in list(self.cache.items()):
+            if other != index and not future.done() and future.cancel():
+                del self.cache[other]
+
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+
+        future = self.executor.submit(
+            lambda: SuperpixelMap(compute_superpixels(image, self.region_size))
+        )
+        self.cache[index] = future
+        if len(self.cache) > self.cache_size:
+            _, oldest = self.cache.popitem(last=False)
+            oldest.cancel()
+        return future
+
+    def clear(self):
+        for future in self.cache.values():
+            future.cancel()
+        self.cache.clear()
+
+    def close(self):
+        self.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,51 +1,74 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-# Import dataclasses
-
 import cv2
+import numpy as np
+
+from typing import List
+
+from src.image_cache import ImageCache
+from src.manifest import CsvManifest
+from src.masks import ImageMasks
+
+def signed_distance(mask: np.ndarray) -> np.ndarray:
+    """Signed distance field of a binary mask, positive inside and negative outside."""
+    binary = (mask > 0).astype(np.uint8)
+    inside = cv2.distanceTransform(binary, cv2.DIST_L2, 5)
+    outside = cv2.distanceTransform(1 - binary, cv2.DIST_L2, 5)
+
+    # An empty (or full) mask has no boundary, clip so it does not dominate the blend
+    limit = float(max(mask.shape[:2]))
+    return np.clip(inside - outside, -limit, limit).astype(np.float32)
 
-from dataclasses import dataclass, field
-from typing import Dict, List, Any
 
-import pandas as pd
+def mask_centroid(mask: np.ndarray) -> np.ndarray:
+    """Centroid (x, y) of a binary mask, None for empty masks."""
+    moments = cv2.moments((mask > 0).astype(np.uint8), binaryImage=True)
+    if moments["m00"] == 0:
+        return None
+    return np.array([moments["m10"] / moments["m00"], moments["m01"] / moments["m00"]], dtype=np.float32)
 
-@dataclass
-class ImageMasks:
-    labels: List[str]
-    image_index: int = None
-    save_name: Any = None
-    masks: Dict[str, Any] = field(init=False)
 
-    def __post_init__(self):
-        if not self.labels:
-            raise ValueError("labels list must be non-empty")
-        # Initialize all labels with None
-        self.masks = {label: None for label in self.labels}
+def shift_image(image: np.ndarray, offset, border_value=0) -> np.ndarray:
+    """Translates an image by an (x, y) offset."""
+    h, w = image.shape[:2]
+    matrix = np.float32([[1, 0, offset[0]], [0, 1, offset[1]]])
+    return cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_NEAREST,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=border_value)
 
-    def set_index(self, image_index: int):
-        self.image_index = image_index
 
-    def set(self, mask: Any, label: str):
-        if label not in self.masks:
-            return
-        self.masks[label] = mask
+def shape_interpolator(start_mask: np.ndarray, end_mask: np.ndarray):
+    """
+    Returns a function interpolating batches of binary masks between two keyframe masks.
 
-    def get(self, label: str):
-        return self.masks.get(label, None)
+    The shapes are blended as signed distance fields after aligning their
+    centroids, and every blended shape is then moved along the line between
+    the two centroids, so that moving objects do not vanish half way. The
+    returned function maps a sequence of weights in [0, 1] to a stack of masks.
+    """
+    start_centroid = mask_centroid(start_mask)
+    end_centroid = mask_centroid(end_mask)
+    if start_centroid is None or end_centroid is None:
+        displacement = np.zeros(2, dtype=np.float32)
+    else:
+        displacement = end_centroid - start_centroid
 
-    def get_index(self):
-        return self.image_index
+    sdf_start = signed_distance(start_mask)
+    limit = float(max(end_mask.shape[:2]))
+    sdf_end = shift_image(signed_distance(end_mask), -displacement, border_value=-limit)
 
-    def get_all(self) -> Dict[str, Any]:
-        """Returns all label-mask pairs."""
-        return self.masks
+    def interpolate(weights) -> np.ndarray:
+        weights = np.asarray(weights, dtype=np.float32)
+        w = weights[:, None, None]
+        blended = sdf_start[None] * (1.0 - w) + sdf_end[None] * w
+        masks = (blended > 0).astype(np.uint8) * 255
 
-    def set_save_name(self, save_name: str):
-        self.save_name = save_name
+        return np.stack([
+            shift_image(mask, displacement * weight) for mask, weight in zip(masks, weights)
+        ])
 
-    def get_save_name(self):
-        return self.save_name
+    return interpolate
 
 
 class DataLoader:
@@ -56,6 +79,7 @@ class DataLoader:
         self.labels = labels
         self.max_index = None
         self.output_dir_name = None
+        self.source_path = None
 
     def set_output_dir_name(self, dir_name: str):
         self.output_dir_name = dir_name
@@ -63,6 +87,13 @@ class DataLoader:
     def get_output_dir_name(self):
         return self.output_dir_name
 
+    def set_source_path(self, path):
+        """File or folder the dataset was opened from, identifies the dataset beyond its name."""
+        self.source_path = Path(path).resolve()
+
+    def get_source_path(self):
+        return self.source_path
+
     # Define the load_data and get_datapoint methods to be overridden by subclasses
     def set_max_index(self, max_index: int):
         if max_index <= 0:
@@ -78,12 +109,16 @@ class DataLoader:
     def get_datapoint(self, index: int):
         raise NotImplementedError("Subclasses should implement this method.")
 
+    def close(self):
+        """Releases the resources of the data loader, called when another dataset is opened."""
+        pass
+
 
     def delete_mask(self, index: int, label: str):
         if index < 0 or index >= self.max_index:
             raise ValueError(f"Index {index} is out of range.")
 
-        mask = self.masks.get(index, ImageMasks(labels=self.labels))
+        mask = self.get_masks(index)
         mask.set(mask=None, label=label)
         self.masks[index] = mask
 
@@ -107,11 +142,15 @@ class DataLoader:
         if not Path(folder).is_dir():
             raise ValueError(f"{folder} is not a directory.")
         for index, mask in self.masks.items():
-            for label in self.labels:
-                mask_img = mask.get(label)
-                if mask_img is not None:
-                    filename = f"{mask.get_save_name()}__{label}.png"
-                    cv2.imwrite(str(Path(folder) / filename), mask_img)
+            self.write_masks(mask, folder)
+
+    def write_masks(self, mask: ImageMasks, folder: str):
+        for label in self.labels:
+            mask_img = mask.get(label)
+            # Generated masks are only exported once the annotator confirmed them
+            if mask_img is not None and not mask.is_provisional(label):
+                filename = f"{mask.get_save_name()}__{label}.png"
+                cv2.imwrite(str(Path(folder) / filename), mask_img)
 
 
 class VideoDataLoader(DataLoader):
@@ -134,6 +173,7 @@ class VideoDataLoader(DataLoader):
         self.video_path = self.video_dir / f"{video_name}.mp4"
 
         self.set_output_dir_name(video_name)
+        self.set_source_path(self.video_path)
 
         self.video = cv2.VideoCapture(str(self.video_path))
         if not self.video.isOpened():
@@ -141,6 +181,7 @@ class VideoDataLoader(DataLoader):
         
         # Get the number of frames in the video
         self.set_max_index(int(self.video.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.fps = self.video.get(cv2.CAP_PROP_FPS) or 30.0
 
         masks_dir = self.video_dir / video_name / "masks"
         masks = masks_dir.glob("*.png")
@@ -171,10 +212,149 @@ class VideoDataLoader(DataLoader):
             raise ValueError(f"Could not read frame {frame_number} from video.")
         
         return frame
-    
+
+    def close(self):
+        self.video.release()
+
+    def stream_frames(self, start: int, direction: int = 1, block_size: int = 32):
+        """
+        Yields (frame_number, frame) pairs starting at a frame, moving forward or backward.
+
+        Frames are decoded sequentially from a dedicated capture, so the stream
+        can run in a background thread and avoids a seek for every frame.
+        Backward streams decode blocks of frames forward and yield them reversed.
+        """
+        if start < 0 or start >= self.max_index:
+            raise ValueError(f"Frame number {start} is out of range.")
+        if direction not in (1, -1):
+            raise ValueError("direction must be 1 or -1.")
+
+        video = cv2.VideoCapture(str(self.video_path))
+        if not video.isOpened():
+            raise ValueError(f"Could not open video file: {self.video_path}")
+
+        try:
+            if direction == 1:
+                video.set(cv2.CAP_PROP_POS_FRAMES, start)
+                for frame_number in range(start, self.max_index):
+                    ret, frame = video.read()
+                    if not ret:
+                        return
+                    yield frame_number, frame
+            else:
+                block_end = start + 1
+                while block_end > 0:
+                    block_start = max(0, block_end - block_size)
+                    video.set(cv2.CAP_PROP_POS_FRAMES, block_start)
+                    block = []
+                    for _ in range(block_start, block_end):
+                        ret, frame = video.read()
+                        if not ret:
+                            return
+                        block.append(frame)
+                    for offset, frame in enumerate(reversed(block)):
+                        yield block_end - 1 - offset, frame
+                    block_end = block_start
+        finally:
+            video.release()
+
+    def frame_masks(self, frame_number: int) -> ImageMasks:
+        """Returns the stored masks of a frame, creating them if needed."""
+        masks = self.masks[frame_number]
+        masks.set_index(frame_number)
+        masks.set_save_name(f"{frame_number:07d}")
+        return masks
+
+    def get_masks(self, index: int):
+        if index < 0 or index >= self.max_index:
+            raise ValueError(f"Index {index} is out of range.")
+
+        # Hand out the stored masks, so that masks generated in the background
+        # land on the same object the canvas is editing
+        return self.frame_masks(index)
+
+    def interpolate_masks(self, label: str, keyframes: List[int] = None,
+                          batch_size: int = 8, workers: int = None,
+                          frame_range=None) -> List[int]:
+        """
+        Fills the frames between keyframes with provisional masks for a label.
+
+        The masks are generated by blending the signed distance fields of
+        consecutive keyframes, see shape_interpolator. If no keyframes are
+        given, every frame holding a confirmed mask for the label is used,
+        only within frame_range (first, last) if it is given, and confirmed
+        empty masks mark where the object is out of view: the gaps next to
+        them are left alone. Keyframes given explicitly must not be empty.
+        Frames that already hold a confirmed mask are never overwritten.
+        Returns the generated frame numbers.
+        """
+        if label not in self.labels:
+            raise ValueError(f"Unknown label {label}.")
+        if batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer.")
+
+        def is_confirmed(frame_number):
+            masks = self.masks.get(frame_number)
+            return (masks is not None and masks.get(label) is not None
+                    and not masks.is_provisional(label))
+
+        explicit = keyframes is not None
+        if not explicit:
+            keyframes = [fnum for fnum in self.masks if is_confirmed(fnum)]
+            if frame_range is not None:
+                keyframes = [fnum for fnum in keyframes if frame_range[0] <= fnum <= frame_range[1]]
+        keyframes = sorted(set(keyframes))
+
+        for fnum in keyframes:
+            if fnum < 0 or fnum >= self.max_index:
+                raise ValueError(f"Frame number {fnum} is out of range.")
+            if self.masks.get(fnum) is None or self.masks[fnum].get(label) is None:
+                raise ValueError(f"Frame {fnum} has no {label} mask to use as a keyframe.")
+            # An empty shape has no boundary to blend from, the object would
+            # vanish in the first generated frame instead of shrinking
+            if explicit and not self.masks[fnum].get(label).any():
+                raise ValueError(f"Frame {fnum} has an empty {label} mask and cannot be used as a keyframe.")
+
+        is_empty = {fnum: not self.masks[fnum].get(label).any() for fnum in keyframes}
+        if sum(not empty for empty in is_empty.values()) < 2:
+            raise ValueError(f"At least two keyframes with a {label} mask are required.")
+
+        jobs = []
+        for start, end in zip(keyframes[:-1], keyframes[1:]):
+            if is_empty[start] or is_empty[end]:
+                continue
+            frames = [fnum for fnum in range(start + 1, end) if not is_confirmed(fnum)]
+            if not frames:
+                continue
+
+            start_mask = self.masks[start].get(label)
+            end_mask = self.masks[end].get(label)
+            if start_mask.shape != end_mask.shape:
+                raise ValueError(f"Keyframes {start} and {end} have masks of different sizes.")
+
+            interpolate = shape_interpolator(start_mask, end_mask)
+            for i in range(0, len(frames), batch_size):
+                batch = frames[i:i + batch_size]
+                weights = [(fnum - start) / (end - start) for fnum in batch]
+                jobs.append((batch, interpolate, weights))
+
+        # OpenCV and numpy release the GIL, so the batches run in parallel threads
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                lambda job: (job[0], job[1](job[2])), jobs
+            )
+
+            generated = []
+            for batch, masks in results:
+                for fnum, mask in zip(batch, masks):
+                    self.frame_masks(fnum).set(mask=mask, label=label, provisional=True)
+                    generated.append(fnum)
+
+        return generated
+
 
 class ImageDataLoader(DataLoader):
-    def __init__(self, annotations_file: str, labels: list):
+    def __init__(self, annotations_file: str, labels: list, cache_size: int = 32, prefetch: int = 4):
         assert Path(annotations_file).exists(), f"File {annotations_file} does not exist."
         assert Path(annotations_file).is_file(), f"{annotations_file} is not a file."
         assert len(labels) > 0, "Labels list cannot be empty."
@@ -187,44 +367,76 @@ class ImageDataLoader(DataLoader):
         self.data = self.load_data()
         self.max_index = len(self.data)
 
+        # Decoded images, the next ones in the navigation direction are read ahead
+        self.images = ImageCache(self.read_image, self.max_index,
+                                 cache_size=cache_size, prefetch=prefetch)
+
     def load_data(self):
 
         self.set_output_dir_name(self.annotations_file.stem)
-        
-        df = pd.read_csv(self.annotations_file)
-
-        for idx, row in df.iterrows():
-            image_path = row['image']
-            image_name = Path(image_path).stem
-            for label in self.labels:
-                if not label in row or pd.isna(row[label]):
-                    continue
-
-                mask_path = row[label]
-                mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
-                mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
-                self.masks[idx].set(
-                    mask=mask, 
-                    label=label
-                        )
-                
-            self.masks[idx].set_index(idx)
-            self.masks[idx].set_save_name(image_name)
-                
-        return df
+        self.set_source_path(self.annotations_file)
+
+        # Only the row offsets are indexed here, masks are read when a row is opened
+        manifest = CsvManifest(self.annotations_file)
+        if "image" not in manifest.columns:
+            raise ValueError(f"{self.annotations_file} has no image column.")
+
+        return manifest
+
+    def load_masks(self, index: int, row: dict) -> ImageMasks:
+        masks = ImageMasks(labels=self.labels)
+        for label in self.labels:
+            mask_path = row.get(label)
+            if not mask_path:
+                continue
+
+            mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+            if mask is None:
+                raise ValueError(f"Could not read mask file {mask_path}.")
+            mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+            masks.set(
+                mask=mask,
+                label=label
+                )
 
-    def get_datapoint(self, index: int):
+        masks.set_index(index)
+        masks.set_save_name(Path(row['image']).stem)
+        return masks
+
+    def get_masks(self, index: int):
         if index < 0 or index >= self.max_index:
             raise ValueError(f"Index {index} is out of range.")
 
-        row = self.data.iloc[index]
-        image_path = row['image']
-        if not Path(image_path).exists():
-            raise ValueError(f"Image file {image_path} does not exist.")
-        if not Path(image_path).is_file():
-            raise ValueError(f"{image_path} is not a file.")
+        if index not in self.masks:
+            self.masks[index] = self.load_masks(index, self.data.row(index))
+        return self.masks[index]
+
+    def save_all_masks(self, folder: str):
+        super().save_all_masks(folder)
+
+        # Rows that were never opened still hold the masks listed in the manifest
+        for index, row in enumerate(self.data):
+            if index not in self.masks:
+                self.write_masks(self.load_masks(index, row), folder)
+
+    def read_image(self, index: int):
+        image_path = self.data.row(index)['image']
         image = cv2.imread(image_path)
         if image is None:
+            # Only look at the file system to explain a failed read
+            if not Path(image_path).exists():
+                raise ValueError(f"Image file {image_path} does not exist.")
+            if not Path(image_path).is_file():
+                raise ValueError(f"{image_path} is not a file.")
             raise ValueError(f"Could not read image file {image_path}.")
 
-        return image
\ No newline at end of file
+        return image
+
+    def close(self):
+        self.images.close()
+
+    def get_datapoint(self, index: int):
+        if index < 0 or index >= self.max_index:
+            raise ValueError(f"Index {index} is out of range.")
+
+        return self.images.get(index)
@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from src.image_cache import ImageCache
+
+
+class FakeLoad:
+    """Records the loaded indices, and fails for the indices in failing."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.loaded = []
+        self._lock = threading.Lock()
+
+    def __call__(self, index):
+        with self._lock:
+            self.loaded.append(index)
+        if index in self.failing:
+            raise ValueError(f"Could not read image {index}.")
+        return f"image {index}"
+
+
+def settle(cache):
+    for future in list(cache.cache.values()):
+        try:
+            future.result()
+        except Exception:
+            pass
+
+
+def test_cache_size_is_bounded():
+    load = FakeLoad()
+    cache = ImageCache(load, max_index=100, cache_size=5, prefetch=2)
+
+    for index in range(20):
+        assert cache.get(index) == f"image {index}"
+        assert len(cache.cache) <= 5
+    settle(cache)
+
+    # The current image is the most recent entry, the oldest ones were evicted
+    assert list(cache.cache)[-1] == 19
+    assert 0 not in cache.cache
+    cache.close()
+
+
+def test_prefetch_follows_the_direction():
+    load = FakeLoad()
+    cache = ImageCache(load, max_index=10, cache_size=8, prefetch=2)
+
+    cache.get(5)
+    settle(cache)
+    assert {6, 7} <= set(cache.cache) and 4 not in cache.cache
+
+    cache.get(4)
+    settle(cache)
+    assert {2, 3} <= set(cache.cache)
+
+    # No reads past the ends of the data
+    cache.get(0)
+    settle(cache)
+    assert all(0 <= index < 10 for index in load.loaded)
+
+    loaded = len(load.loaded)
+    cache.get(3)
+    assert len(load.loaded) == loaded
+    cache.close()
+
+
+def test_failed_reads_are_not_cached():
+    load = FakeLoad(failing={3})
+    cache = ImageCache(load, max_index=10, cache_size=8, prefetch=1)
+
+    with pytest.raises(ValueError):
+        cache.get(3)
+    assert 3 not in cache.cache
+
+    # The file was fixed in the meantime
+    load.failing.clear()
+    assert cache.get(3) == "image 3"
+    cache.close()
+
+
+def test_close_stops_the_prefetcher():
+    cache = ImageCache(FakeLoad(), max_index=10, cache_size=8, prefetch=2)
+    cache.get(0)
+    cache.close()
+
+    assert not cache.cache
+    with pytest.raises(RuntimeError):
+        cache.executor.submit(print)
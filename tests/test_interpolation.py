@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.utils import VideoDataLoader, mask_centroid, shape_interpolator
+
+LABELS = ["polyp", "wire"]
+SHAPE = (120, 220)
+FRAMES = 12
+
+
+def circle(x: int, y: int = 60, radius: int = 20):
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    cv2.circle(mask, (x, y), radius, 255, -1)
+    return mask
+
+
+@pytest.fixture
+def loader(tmp_path):
+    video_dir = tmp_path / "clip"
+    video_dir.mkdir()
+    writer = cv2.VideoWriter(str(video_dir / "clip.mp4"), cv2.VideoWriter_fourcc(*"mp4v"),
+                             10, (SHAPE[1], SHAPE[0]))
+    for _ in range(FRAMES):
+        writer.write(np.zeros(SHAPE + (3,), dtype=np.uint8))
+    writer.release()
+    return VideoDataLoader(str(video_dir), LABELS)
+
+
+def set_mask(loader, frame, mask, label="polyp", provisional=False):
+    loader.frame_masks(frame).set(mask=mask, label=label, provisional=provisional)
+
+
+def test_interpolator_moves_the_centroid():
+    interpolate = shape_interpolator(circle(60), circle(160))
+    start, middle, end = interpolate([0.0, 0.5, 1.0])
+
+    assert mask_centroid(start)[0] == pytest.approx(60, abs=1)
+    assert mask_centroid(middle)[0] == pytest.approx(110, abs=1)
+    assert mask_centroid(end)[0] == pytest.approx(160, abs=1)
+    # The object keeps its size instead of fading out between the keyframes
+    assert (middle > 0).sum() == pytest.approx((start > 0).sum(), rel=0.05)
+
+
+def test_generated_masks_are_provisional(loader):
+    set_mask(loader, 0, circle(60))
+    set_mask(loader, 4, circle(160))
+
+    assert loader.interpolate_masks("polyp") == [1, 2, 3]
+    for frame in [1, 2, 3]:
+        assert loader.get_masks(frame).is_provisional("polyp")
+    assert not loader.get_masks(0).is_provisional("polyp")
+    assert mask_centroid(loader.get_masks(2).get("polyp"))[0] == pytest.approx(110, abs=1)
+
+
+def test_confirmed_frames_are_not_overwritten(loader):
+    set_mask(loader, 0, circle(60))
+    set_mask(loader, 2, circle(100, radius=10), label="wire")
+    set_mask(loader, 6, circle(160))
+    confirmed = circle(30, radius=5)
+
+    # A confirmed mask between keyframes becomes a keyframe itself
+    set_mask(loader, 3, confirmed)
+    # Provisional masks are regenerated
+    set_mask(loader, 5, circle(200), provisional=True)
+
+    assert loader.interpolate_masks("polyp") == [1, 2, 4, 5]
+    assert np.array_equal(loader.get_masks(3).get("polyp"), confirmed)
+    assert loader.get_masks(5).get("polyp")[60, 200] == 0
+    assert loader.get_masks(2).get("wire") is not None
+
+
+def test_frame_range(loader):
+    set_mask(loader, 0, circle(60))
+    set_mask(loader, 3, circle(100))
+    set_mask(loader, 6, circle(160))
+
+    assert loader.interpolate_masks("polyp", frame_range=(3, 11)) == [4, 5]
+    assert loader.get_masks(1).get("polyp") is None
+
+
+def test_empty_masks_split_the_keyframes(loader):
+    set_mask(loader, 0, circle(60))
+    set_mask(loader, 3, circle(100))
+    # The object left the view, and came back
+    set_mask(loader, 5, np.zeros(SHAPE, dtype=np.uint8))
+    set_mask(loader, 8, circle(120))
+    set_mask(loader, 10, circle(160))
+
+    assert loader.interpolate_masks("polyp") == [1, 2, 9]
+    assert loader.get_masks(4).get("polyp") is None
+    assert loader.get_masks(6).get("polyp") is None
+
+
+def test_empty_keyframes(loader):
+    set_mask(loader, 0, circle(60))
+    set_mask(loader, 4, np.zeros(SHAPE, dtype=np.uint8))
+
+    with pytest.raises(ValueError, match="empty"):
+        loader.interpolate_masks("polyp", keyframes=[0, 4])
+    with pytest.raises(ValueError, match="At least two"):
+        loader.interpolate_masks("polyp")
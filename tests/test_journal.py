@@ -0,0 +1,244 @@
+import numpy as np
+import pytest
+
+from src.journal import (
+    DELETED, FRAME_HEADER, RECORD_HEADER, MaskJournal, encode_record, journal_directory,
+    merge_journals, read_records
+)
+from src.masks import ImageMasks
+from src.utils import DataLoader
+
+LABELS = ["polyp", "wire"]
+SHAPE = (20, 30)
+
+
+def make_loader(frames: int = 10):
+    loader = DataLoader(labels=LABELS)
+    loader.set_max_index(frames)
+    return loader
+
+
+def set_mask(loader, frame, label, mask, provisional=False):
+    masks = loader.get_masks(frame)
+    masks.set(mask=mask, label=label, provisional=provisional)
+    loader.set_frame_masks(frame, masks)
+
+
+def open_journal(tmp_path, loader, **kwargs):
+    journal = MaskJournal(tmp_path, loader, **kwargs)
+    journal.replay()
+    return journal
+
+
+def test_replay_restores_stroke_regions(tmp_path):
+    loader = make_loader()
+    journal = open_journal(tmp_path, loader)
+
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[2:5, 3:8] = 255
+    set_mask(loader, 1, "polyp", mask)
+    journal.record(1, "polyp", (2, 3, 5, 8))
+
+    set_mask(loader, 2, "wire", mask.copy(), provisional=True)
+    journal.record(2, "wire")
+    journal.close()
+
+    restored = make_loader()
+    assert MaskJournal(tmp_path, restored).replay() == 2
+    assert np.array_equal(restored.get_masks(1).get("polyp"), mask)
+    assert not restored.get_masks(1).is_provisional("polyp")
+    assert restored.get_masks(2).is_provisional("wire")
+
+
+def test_torn_record_is_dropped(tmp_path):
+    loader = make_loader()
+    journal = open_journal(tmp_path, loader)
+    set_mask(loader, 1, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+    journal.record(1, "polyp")
+    valid_size = journal.path.stat().st_size
+
+    # A crash in the middle of the next append
+    record = encode_record(2, "polyp", loader.get_masks(1))
+    journal.file.write(record[:len(record) // 2])
+    journal.close()
+
+    restored = make_loader()
+    journal = MaskJournal(tmp_path, restored)
+    assert journal.replay() == 1
+    assert journal.path.stat().st_size == valid_size
+    assert restored.get_masks(2).get("polyp") is None
+
+    # New records follow the valid ones
+    set_mask(restored, 3, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+    journal.record(3, "polyp")
+    journal.close()
+    assert [record[0] for record in read_records(journal.path)] == [1, 3]
+
+
+def test_corrupt_record_stops_reading(tmp_path):
+    loader = make_loader()
+    journal = open_journal(tmp_path, loader)
+    set_mask(loader, 1, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+    journal.record_many([1, 1], "polyp")
+    journal.close()
+
+    data = bytearray(journal.path.read_bytes())
+    data[-1] ^= 0xFF
+    journal.path.write_bytes(bytes(data))
+
+    assert len(list(read_records(journal.path))) == 1
+
+
+def test_roi_is_clipped_to_the_mask():
+    masks = ImageMasks(labels=LABELS)
+    masks.set(mask=np.full(SHAPE, 255, dtype=np.uint8), label="polyp")
+
+    # (top, left, bottom, right) in, (top, left, height, width) stored
+    for roi, expected in [
+        ((-5, -5, 3, 4), (0, 0, 3, 4)),
+        ((15, 25, 40, 50), (15, 25, 5, 5)),
+        ((30, 40, 50, 60), (0, 0, 0, 0)),
+    ]:
+        record = encode_record(0, "polyp", masks, roi)
+        assert RECORD_HEADER.unpack_from(record, FRAME_HEADER.size)[4:8] == expected
+
+
+def test_empty_roi_leaves_mask_unchanged(tmp_path):
+    loader = make_loader()
+    journal = open_journal(tmp_path, loader)
+    mask = np.full(SHAPE, 255, dtype=np.uint8)
+    set_mask(loader, 1, "polyp", mask)
+    journal.record(1, "polyp")
+    journal.record(1, "polyp", (100, 100, 200, 200))
+    journal.close()
+
+    restored = make_loader()
+    MaskJournal(tmp_path, restored).replay()
+    assert np.array_equal(restored.get_masks(1).get("polyp"), mask)
+
+
+def test_deleted_record_removes_mask(tmp_path):
+    loader = make_loader()
+    journal = open_journal(tmp_path, loader)
+    set_mask(loader, 1, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+    journal.record(1, "polyp")
+    set_mask(loader, 1, "polyp", None)
+    journal.record(1, "polyp")
+    journal.close()
+
+    flags = [record[2] for record in read_records(journal.path)]
+    assert flags[-1] & DELETED
+
+    restored = make_loader()
+    set_mask(restored, 1, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+    MaskJournal(tmp_path, restored).replay()
+    assert restored.get_masks(1).get("polyp") is None
+
+
+def test_replay_compacts_the_journal(tmp_path):
+    loader = make_loader()
+    journal = open_journal(tmp_path, loader)
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    for row in range(5):
+        mask[row] = 255
+        set_mask(loader, 1, "polyp", mask.copy())
+        journal.record(1, "polyp", (row, 0, row + 1, SHAPE[1]))
+    journal.close()
+
+    restored = make_loader()
+    journal = MaskJournal(tmp_path, restored)
+    assert journal.replay() == 5
+    journal.close()
+
+    assert len(list(read_records(journal.path))) == 1
+    assert np.array_equal(restored.get_masks(1).get("polyp"), mask)
+
+
+def test_record_outside_shard(tmp_path):
+    loader = make_loader()
+    journal = open_journal(tmp_path, loader, shard="a", frame_range=(0, 4))
+    set_mask(loader, 5, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+
+    with pytest.raises(ValueError):
+        journal.record_many([3, 5], "polyp")
+    assert journal.records == 0
+
+
+def test_merge_disjoint_shards(tmp_path):
+    for shard, frame in [("a", 1), ("b", 7)]:
+        loader = make_loader()
+        journal = open_journal(tmp_path, loader, shard=shard)
+        set_mask(loader, frame, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+        journal.record(frame, "polyp")
+        journal.close()
+
+    merged = make_loader()
+    assert merge_journals(tmp_path, merged) == ["a", "b"]
+    assert merged.get_masks(1).get("polyp") is not None
+    assert merged.get_masks(7).get("polyp") is not None
+
+
+def test_merge_conflict(tmp_path):
+    for shard in ["a", "b"]:
+        loader = make_loader()
+        journal = open_journal(tmp_path, loader, shard=shard)
+        set_mask(loader, 3, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+        journal.record(3, "polyp")
+        journal.close()
+
+    merged = make_loader()
+    with pytest.raises(ValueError, match="Frame 3"):
+        merge_journals(tmp_path, merged)
+    # Nothing is applied when the shards conflict
+    assert 3 not in merged.masks
+
+
+def test_non_binary_masks_round_trip(tmp_path):
+    loader = make_loader()
+    journal = open_journal(tmp_path, loader)
+    binary = np.zeros(SHAPE, dtype=np.uint8)
+    binary[5:9, 4:12] = 255
+    grey = np.arange(SHAPE[0] * SHAPE[1], dtype=np.uint8).reshape(SHAPE)
+    set_mask(loader, 1, "polyp", binary)
+    set_mask(loader, 1, "wire", grey)
+    journal.record(1, "polyp", (3, 3, 11, 14))
+    journal.record(1, "wire")
+    journal.close()
+
+    restored = make_loader()
+    MaskJournal(tmp_path, restored).replay()
+    assert np.array_equal(restored.get_masks(1).get("polyp"), binary)
+    assert np.array_equal(restored.get_masks(1).get("wire"), grey)
+
+
+def test_journal_directory_is_keyed_on_the_dataset_path(tmp_path):
+    directories = []
+    for folder in ["a", "b", "a"]:
+        loader = make_loader()
+        loader.set_output_dir_name("annotations")
+        loader.set_source_path(tmp_path / folder / "annotations.csv")
+        directories.append(journal_directory(tmp_path / "journals", loader))
+
+    assert directories[0] != directories[1]
+    assert directories[0] == directories[2]
+    assert directories[0].name.startswith("annotations-")
+
+
+def test_journal_of_another_dataset_is_not_replayed(tmp_path):
+    loader = make_loader(frames=60)
+    journal = open_journal(tmp_path, loader)
+    set_mask(loader, 2, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+    set_mask(loader, 50, "polyp", np.full(SHAPE, 255, dtype=np.uint8))
+    journal.record_many([2, 50], "polyp")
+    journal.close()
+    size = journal.path.stat().st_size
+
+    shorter = make_loader(frames=10)
+    with pytest.raises(ValueError, match="frame 50"):
+        MaskJournal(tmp_path, shorter).replay()
+    with pytest.raises(ValueError, match="frame 50"):
+        merge_journals(tmp_path, shorter)
+
+    # Nothing applied, and the journal is left as it was
+    assert 2 not in shorter.masks
+    assert journal.path.stat().st_size == size
@@ -0,0 +1,70 @@
+import pytest
+
+from src.manifest import CsvManifest
+
+# Small chunks make rows, quoted fields and line breaks straddle chunk boundaries
+CHUNK_SIZES = [1, 2, 3, 5, 7, 1 << 20]
+
+
+def write_csv(tmp_path, content: bytes):
+    path = tmp_path / "annotations.csv"
+    path.write_bytes(content)
+    return path
+
+
+def rows(manifest):
+    return [manifest.row(index) for index in range(len(manifest))]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_crlf_line_endings(tmp_path, chunk_size):
+    path = write_csv(tmp_path, b"image,polyp\r\na.png,ma.png\r\nb.png,mb.png\r\n")
+    manifest = CsvManifest(path, chunk_size=chunk_size)
+
+    expected = [{"image": "a.png", "polyp": "ma.png"}, {"image": "b.png", "polyp": "mb.png"}]
+    assert rows(manifest) == expected
+    assert list(manifest) == expected
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_quoted_newlines(tmp_path, chunk_size):
+    path = write_csv(tmp_path, b'image,polyp\n"a\nb.png","m""a\n\n.png"\nc.png,mc.png\n')
+    manifest = CsvManifest(path, chunk_size=chunk_size)
+
+    expected = [{"image": "a\nb.png", "polyp": 'm"a\n\n.png'}, {"image": "c.png", "polyp": "mc.png"}]
+    assert rows(manifest) == expected
+    assert list(manifest) == expected
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_last_row_without_newline(tmp_path, chunk_size):
+    path = write_csv(tmp_path, b"image,polyp\na.png,ma.png\nb.png,mb.png")
+    manifest = CsvManifest(path, chunk_size=chunk_size)
+
+    assert rows(manifest) == [{"image": "a.png", "polyp": "ma.png"}, {"image": "b.png", "polyp": "mb.png"}]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_blank_lines(tmp_path, chunk_size):
+    path = write_csv(tmp_path, b"image,polyp\n\na.png,ma.png\r\n\r\n\nb.png,\n\n")
+    manifest = CsvManifest(path, chunk_size=chunk_size)
+
+    expected = [{"image": "a.png", "polyp": "ma.png"}, {"image": "b.png", "polyp": ""}]
+    assert rows(manifest) == expected
+    assert list(manifest) == expected
+
+
+def test_header_only_and_bom(tmp_path):
+    path = write_csv(tmp_path, b"\xef\xbb\xbfimage,polyp\n")
+    manifest = CsvManifest(path)
+
+    assert manifest.columns == ["image", "polyp"]
+    assert len(manifest) == 0
+
+
+def test_row_out_of_range(tmp_path):
+    path = write_csv(tmp_path, b"image\na.png\n")
+    manifest = CsvManifest(path)
+
+    with pytest.raises(ValueError):
+        manifest.row(1)
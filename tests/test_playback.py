@@ -0,0 +1,129 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from src.masks import ImageMasks
+from src.playback import FramePlayer, composite_masks
+from src.utils import VideoDataLoader
+
+SHAPE = (48, 64)
+
+
+class FakeLoader:
+    max_index = 100
+    fps = 10.0
+    masks = {}
+
+
+def make_player(**kwargs):
+    player = FramePlayer(FakeLoader(), start_frame=0, colors={}, **kwargs)
+    # Driven by hand, without the decoder thread
+    player.start_time = time.perf_counter()
+    return player
+
+
+def set_clock(player, frame):
+    """Moves the playback clock to the middle of a frame."""
+    player.start_time = time.perf_counter() - (frame + 0.5) / player.rate
+
+
+def queue_frames(player, frames):
+    for frame_number in frames:
+        player.frames.put((frame_number, f"image {frame_number}"))
+
+
+def test_frames_are_shown_when_due():
+    player = make_player(queue_size=16)
+    queue_frames(player, [0, 1, 2])
+
+    set_clock(player, 0)
+    assert player.next_frame() == (0, "image 0")
+    assert player.next_frame() is None
+
+    set_clock(player, 1)
+    assert player.next_frame() == (1, "image 1")
+    assert (player.shown, player.dropped, player.last_frame) == (2, 0, 1)
+
+
+def test_late_frames_are_dropped():
+    player = make_player(queue_size=16)
+    queue_frames(player, range(6))
+
+    # Frames 0 to 3 are due at once, only the newest is shown
+    set_clock(player, 3)
+    assert player.next_frame() == (3, "image 3")
+    assert (player.shown, player.display_dropped) == (1, 3)
+
+    set_clock(player, 5)
+    assert player.next_frame() == (5, "image 5")
+    assert player.display_dropped == 4
+
+
+def test_speed_scales_the_clock():
+    player = make_player(speed=2.0)
+    assert player.rate == 20.0
+
+    # 0.225 seconds in, twice the 10 fps of the video
+    player.start_time = time.perf_counter() - 0.225
+    assert player.due_frame() == 4
+
+
+def test_finished_after_the_last_frame():
+    player = make_player(queue_size=16)
+    queue_frames(player, [0, 1])
+    player.frames.put((None, None))
+
+    set_clock(player, 10)
+    # The last frame is shown before playback is reported finished
+    assert player.next_frame() == (1, "image 1")
+    assert not player.finished
+    assert player.next_frame() is None
+    assert player.finished
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        FramePlayer(FakeLoader(), start_frame=100, colors={})
+    with pytest.raises(ValueError):
+        FramePlayer(FakeLoader(), start_frame=5, colors={}, end_frame=4)
+    with pytest.raises(ValueError):
+        FramePlayer(FakeLoader(), start_frame=0, colors={}, speed=0)
+
+
+def test_composite_masks_blends_provisional_masks_lighter():
+    frame = np.zeros(SHAPE + (3,), dtype=np.uint8)
+    masks = ImageMasks(labels=["polyp", "wire"])
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[:, :10] = 255
+    masks.set(mask=mask, label="polyp")
+    masks.set(mask=mask, label="wire", provisional=True)
+
+    colors = {"polyp": (255, 0, 0, 255)}
+    assert tuple(composite_masks(frame, masks, colors)[0, 0]) == (255, 0, 0)
+    colors = {"wire": (0, 0, 200, 200)}
+    assert tuple(composite_masks(frame, masks, colors)[0, 0]) == (0, 0, 78)
+    assert tuple(composite_masks(frame, masks, colors)[0, 20]) == (0, 0, 0)
+
+
+def test_decoder_error_is_kept(tmp_path):
+    video_dir = tmp_path / "clip"
+    video_dir.mkdir()
+    writer = cv2.VideoWriter(str(video_dir / "clip.mp4"), cv2.VideoWriter_fourcc(*"mp4v"),
+                             10, (SHAPE[1], SHAPE[0]))
+    for _ in range(4):
+        writer.write(np.zeros(SHAPE + (3,), dtype=np.uint8))
+    writer.release()
+
+    loader = VideoDataLoader(str(video_dir), ["polyp"])
+    # A mask that does not match the size of the frames
+    loader.frame_masks(0).set(mask=np.full((10, 10), 255, dtype=np.uint8), label="polyp")
+
+    # Slow enough that the decoder never skips the frame as late
+    player = FramePlayer(loader, start_frame=0, colors={"polyp": (255, 0, 0, 128)}, speed=0.01)
+    player.start()
+    player._thread.join(timeout=5)
+
+    assert player.error is not None
+    assert player.frames.get_nowait() == (None, None)